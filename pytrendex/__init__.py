@@ -1 +1,3 @@
 from pytrendex.core import Trendex
+from pytrendex.sessions import SessionPool
+from pytrendex.hierarchy import BenchmarkTree
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command line batch runner for pytrendex.
+
+Reads a job file (YAML or JSON) listing the indices to build, runs them through
+a pool of workers that share a pool of pytrends sessions, and writes each result
+to a columnar file. A job file looks like:
+
+    output_dir: indices
+    format: parquet        # or csv
+    workers: 2
+    pace: 6                # minimum seconds between requests of a session
+    sessions:              # optional, one TrendReq identity each
+      - proxies: [https://10.0.0.1:8080]
+      - proxies: [https://10.0.0.2:8080]
+        timeout: [5, 20]
+    defaults:
+      geo: US
+      frequency: weekly
+    indices:
+      - name: gtu
+        kw_list: [stock market, United States Congress, ...]
+        date_start: 2006-01-01
+        date_end: 2017-12-31
+        frequency: monthly
+        options:
+          benchmark_select: false
+
+Usage:
+    pytrendex jobs.yaml [--workers N] [--pace SECONDS] [--only NAME ...]
+
+Exit codes are 0 if every index was built, 1 if any index failed and 2 if the
+job file itself could not be used, or its output could not be written (parquet
+without pyarrow), in which case no index is run.
+"""
+# =============================================================================
+# Imports
+# =============================================================================
+import argparse
+import inspect
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from pytrendex.core import Trendex
+from pytrendex.sessions import SessionPool
+
+# YAML job files are optional, JSON works without it
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Parquet output needs one of the engines pandas writes it with, csv does not
+for PARQUET_ENGINE in ['pyarrow', 'fastparquet']:
+    try:
+        __import__(PARQUET_ENGINE)
+        break
+    except ImportError:
+        pass
+else:
+    PARQUET_ENGINE = None
+
+# Universal parameter(s)
+JOB_KEYS = ['kw_list', 'geo', 'date_start', 'date_end', 'frequency']
+FREQUENCIES = ['daily', 'weekly', 'monthly', 'quarterly']
+# Trendex arguments a job may set under options; the runner sets the others
+OPTIONS = [pp for pp in inspect.signature(Trendex.__init__).parameters
+           if pp not in JOB_KEYS + ['self', 'pytrend', 'plot', 'gen_index']]
+FORMATS = ['parquet', 'csv']
+EXIT_OK, EXIT_FAILED, EXIT_BAD_JOB = 0, 1, 2
+
+
+class JobError(Exception):
+    """Raised when the job file is missing, malformed or inconsistent."""
+
+
+def load_jobs(path):
+    """
+    Read a job file and return its settings and the list of index specs.
+
+    Parameters
+    ----------
+    path: str
+        Path to a .json, .yaml or .yml job file.
+
+    Raises
+    ------
+    JobError
+        If the file cannot be read, or a setting or an index spec is
+        missing, unknown or of the wrong type.
+
+    Returns
+    -------
+    settings: dict
+        The top level settings (output_dir, format, workers, pace, sessions).
+    jobs: list
+        One dict per index, with defaults filled in.
+    """
+    is_yaml = path.endswith(('.yaml', '.yml'))
+    if is_yaml and yaml is None:
+        raise JobError('Reading YAML job files needs PyYAML: pip install pyyaml')
+    try:
+        with open(path, encoding='utf-8') as f:
+            spec = yaml.safe_load(f) if is_yaml else json.load(f)
+    except (OSError, ValueError) + ((yaml.YAMLError,) if yaml else ()) as e:
+        raise JobError('Could not read job file %s: %s' %(path, e))
+
+    if isinstance(spec, list):
+        spec = {'indices': spec}
+    if not isinstance(spec, dict) or not spec.get('indices'):
+        raise JobError('Job file %s lists no indices' %path)
+
+    settings = {'output_dir': spec.get('output_dir', '.'),
+                'format': spec.get('format', 'parquet'),
+                'workers': spec.get('workers', 1),
+                'pace': spec.get('pace', 6),
+                'sessions': spec.get('sessions')}
+    check_settings(settings)
+    if not isinstance(spec['indices'], list):
+        raise JobError('indices must be a list')
+
+    defaults = spec.get('defaults', {})
+    if not isinstance(defaults, dict):
+        raise JobError('defaults must be a mapping')
+    jobs = []
+    for ii, entry in enumerate(spec['indices']):
+        if not isinstance(entry, dict):
+            raise JobError('Index %s must be a mapping' %ii)
+        job = dict(defaults, **entry)
+        job.setdefault('name', 'index_%s' %ii)
+        options = [defaults.get('options', {}), entry.get('options', {})]
+        if not all(isinstance(oo, dict) for oo in options):
+            raise JobError('Index %s: options must be a mapping' %job['name'])
+        job['options'] = dict(options[0], **options[1])
+        check_job(job)
+        # YAML reads bare dates as datetime.date, Trendex wants strings
+        for dd in ['date_start', 'date_end']:
+            if job.get(dd) is not None:
+                job[dd] = str(job[dd])
+        jobs.append(job)
+
+    names = [job['name'] for job in jobs]
+    if len(set(names)) < len(names):
+        raise JobError('Index names in the job file must be unique')
+
+    return settings, jobs
+
+
+def check_settings(settings):
+    """Raise JobError unless the top level settings have usable values."""
+    if settings['format'] not in FORMATS:
+        raise JobError('Unknown format %s, choose one of %s'
+                       %(settings['format'], ', '.join(FORMATS)))
+    workers = settings['workers']
+    if isinstance(workers, bool) or not isinstance(workers, int) or workers < 1:
+        raise JobError('workers must be a whole number of at least 1, not %r' %workers)
+    pace = settings['pace']
+    if isinstance(pace, bool) or not isinstance(pace, (int, float)) or pace < 0:
+        raise JobError('pace must be a number of seconds, not %r' %pace)
+    sessions = settings['sessions']
+    if sessions is not None and not (isinstance(sessions, list) and
+                                     all(isinstance(ss, dict) for ss in sessions)):
+        raise JobError('sessions must be a list of mappings')
+
+
+def check_job(job):
+    """Raise JobError unless an index spec has the keys and types Trendex needs."""
+    name = job['name']
+    unknown = set(job) - set(JOB_KEYS + ['name', 'options'])
+    if unknown:
+        raise JobError('Index %s has unknown keys: %s'
+                       %(name, ', '.join(sorted(map(str, unknown)))))
+    kw_list = job.get('kw_list')
+    if not isinstance(kw_list, list) or not kw_list or \
+            not all(isinstance(kw, str) for kw in kw_list):
+        raise JobError('Index %s: kw_list must be a list of search terms' %name)
+    if not isinstance(job.get('geo'), str):
+        raise JobError('Index %s: geo must be a string' %name)
+    if job.get('frequency', 'daily') not in FREQUENCIES:
+        raise JobError('Index %s: frequency must be one of %s'
+                       %(name, ', '.join(FREQUENCIES)))
+    unknown = set(job['options']) - set(OPTIONS)
+    if unknown:
+        raise JobError('Index %s has unknown options: %s (choose from %s)'
+                       %(name, ', '.join(sorted(map(str, unknown))), ', '.join(OPTIONS)))
+
+
+def run_job(job, sessions):
+    """Build a single index on the session pool, return it and the time taken."""
+    t0 = time.monotonic()
+    options = dict(job['options'])
+    # the session pool keeps the pace, so the per-instance sleeps are off by default
+    options.setdefault('slowdown', False)
+    options['plot'] = False
+    options['gen_index'] = True
+    result = Trendex(job['kw_list'], job['geo'], date_start=job.get('date_start'),
+                     date_end=job.get('date_end'),
+                     frequency=job.get('frequency', 'daily'),
+                     pytrend=sessions, **options)
+    return result, time.monotonic() - t0
+
+
+def write_result(result, name, output_dir, fmt):
+    """Write the adjusted trends and the index side by side, one column each."""
+    frame = result.trends.join(result.gti)
+    path = os.path.join(output_dir, '%s.%s' %(name, fmt))
+    if fmt == 'parquet':
+        frame.to_parquet(path)
+    else:
+        frame.to_csv(path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pytrendex', description='Build Google Trends indices from a job file.')
+    parser.add_argument('jobfile', help='YAML or JSON file listing the indices')
+    parser.add_argument('--workers', type=int, help='number of indices built at once')
+    parser.add_argument('--pace', type=float,
+                        help='minimum seconds between requests of a session')
+    parser.add_argument('--output-dir', help='where to write the results')
+    parser.add_argument('--format', choices=FORMATS, help='output file format')
+    parser.add_argument('--only', nargs='+', metavar='NAME',
+                        help='only build the indices with these names')
+    args = parser.parse_args(argv)
+
+    try:
+        settings, jobs = load_jobs(args.jobfile)
+        for key in ['workers', 'pace', 'output_dir', 'format']:
+            if getattr(args, key) is not None:
+                settings[key] = getattr(args, key)
+        check_settings(settings)
+        if settings['format'] == 'parquet' and PARQUET_ENGINE is None:
+            raise JobError('Writing parquet needs pyarrow: pip install pyarrow, '
+                           'or use --format csv')
+        if args.only:
+            missing = set(args.only) - set(job['name'] for job in jobs)
+            if missing:
+                raise JobError('No index named %s' %', '.join(sorted(missing)))
+            jobs = [job for job in jobs if job['name'] in args.only]
+        os.makedirs(settings['output_dir'], exist_ok=True)
+        sessions = SessionPool(settings['sessions'], pace=settings['pace'])
+    except (JobError, OSError, TypeError) as e:
+        print('pytrendex: %s' %e, file=sys.stderr)
+        return EXIT_BAD_JOB
+    total = len(jobs)
+    done, failed = [], []
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=settings['workers']) as pool:
+        futures = {pool.submit(run_job, job, sessions): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            count = len(done) + len(failed) + 1
+            try:
+                result, elapsed = future.result()
+                path = write_result(result, job['name'],
+                                    settings['output_dir'], settings['format'])
+            except Exception as e:
+                failed.append(job['name'])
+                print('[%s/%s] %s failed: %s' %(count, total, job['name'], e),
+                      file=sys.stderr)
+                traceback.print_exc(file=sys.stderr)
+            else:
+                done.append(job['name'])
+                print('[%s/%s] %s written to %s (%.0fs)'
+                      %(count, total, job['name'], path, elapsed))
+
+    print('%s of %s indices built in %.0fs' %(len(done), total,
+                                             time.monotonic()-started))
+    for session in sessions.sessions:
+        print(session)
+    if failed:
+        print('Failed: %s' %', '.join(failed), file=sys.stderr)
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,10 +7,13 @@
 import pandas as pd
 from numpy.random import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 from statsmodels.api import tsa
 
 # An unofficial google trends API
 from pytrends.request import TrendReq
+from pytrendex.sessions import SessionPool
+from pytrendex.hierarchy import BenchmarkTree
 
 class Trendex:
     """
@@ -54,11 +57,27 @@ class Trendex:
         documentation for that function for description of how this is done.
         If False, then the benchmark will be the first term in the kw_list.
 
+    hierarchical: boolean, optional
+        If True then link the search groups through a tree of intermediate
+        benchmarks chosen by volume (see BenchmarkTree) instead of a single
+        benchmark, and never merge terms with "+". Meant for kw_lists in the
+        thousands. Terms too rarely searched to link are left out of the index
+        (see self.unlinked). Trendex still holds every term of every timechunk
+        in memory; for more than that, use BenchmarkTree on its own.
+        Default is False.
+
     slowdown: boolean, optional
         If True then include time.sleep() at key moments to slow down the index.
         Currently defaults to random intervals of mean 5 or 7 seconds depending on
         where in the code. Remove this at your own peril (Google lockout).
 
+    pytrend: TrendReq, optional
+        A pytrends client to run the searches with. If none provided, the
+        instance uses the shared class-level client. Give each instance its own
+        client when running several indices at once, since payloads are stateful.
+        A SessionPool can be shared by instances, and its sessions pull the
+        timechunks and the search groups of each timechunk in parallel.
+
     seasonal_adjust: boolean, optional (default = True)
         If True, then seasonally adjust the series (recommended). Seasonally
         adjusted trends are always constructed and saved in trends_sa,
@@ -94,6 +113,16 @@ class Trendex:
         Note: means for each segment are bounded from below by 1, so that
         we do not seriously alter indices.
 
+    self.gti_nowcast: Series (nowcast output)
+        The index with provisional values for the most recent days appended,
+        filled in by nowcast(). Only available for daily indices.
+
+    self.nowcast_trends: Dataframe (nowcast output)
+        The provisional daily values for each term, on the scale of trends.
+
+    self.nowcast_factors: Series (nowcast output)
+        The factors used to scale the hourly data onto the daily data.
+
     """
     # Initialize pytrend
     pytrend = TrendReq(tz=300) # tz is the timezone offset, in this case EST
@@ -103,12 +132,17 @@ class Trendex:
     cutoff_m = 270*7 + 10
     overlap = 45 # An arbitrary (long) length of time for the series to overlap
     kw_limit = 20 # Default is to break kw_list into chunks with "+" operator
+    nowcast_timeframe = 'now 7-d' # hourly data, overlaps the last daily chunk
+    nowcast_tol = .5 # hourly benchmarks may be 0 up to this share of the time
 
     def __init__(self, kw_list, geo, date_start=None, date_end=None,
                  frequency='daily', gen_index=True, plot=True, seasonal_adjust=True,
-                 kw_list_split=True, benchmark_select=True, slowdown=True):
+                 kw_list_split=True, benchmark_select=True, slowdown=True,
+                 pytrend=None, hierarchical=False):
 
         # Input Arguments
+        if pytrend is not None:
+            self.pytrend = pytrend
         self.user_kw_list = kw_list.copy()
         self.geo = geo
         self.user_date_start = date_start
@@ -117,9 +151,13 @@ class Trendex:
         self.seasonal = seasonal_adjust
         self.slowdown = slowdown
         self.benchmark_select = benchmark_select
+        self.hierarchical = hierarchical
 
         # Derived Arguments
-        if len(kw_list)>self.kw_limit and kw_list_split:
+        if hierarchical:
+            # the tree drops blanks and duplicates
+            self.kw_list = list(dict.fromkeys(kw.strip() for kw in kw_list if kw.strip()))
+        elif len(kw_list)>self.kw_limit and kw_list_split:
             self.kw_list = self.combine_kw_list(kw_list)
         else:
             self.kw_list = kw_list
@@ -139,6 +177,10 @@ class Trendex:
         self.trends = None
         self.trends_sa = None
         self.gti = None
+        self.nowcast_trends = None
+        self.nowcast_factors = None
+        self.gti_nowcast = None
+        self.unlinked = []
 
 
         # Make the Index, unless False:
@@ -188,6 +230,11 @@ class Trendex:
             Note: Adjustment has still been made by the benchmark term for
             searches exceeding 5 terms.
 
+        self.unlinked: list
+            With hierarchical benchmarks, the terms so rarely searched that no
+            term of the tree measures them (see BenchmarkTree). They are left
+            out of kw_list and of the index.
+
         self.adjustment_factors: Series
             Returns the adjustment factors used on each overlapping segment.
             [term]_1 is the mean of the term in the earlier segment.
@@ -200,10 +247,24 @@ class Trendex:
         # Initialize a few things that will be stored as a result of this
         self.raw_trends = {}
         self.adjustment_factors = {}
-        # Loop through and get all the separate time frames (timechunks makes the intervals)
-        for ii, dd in enumerate(self.timechunks):
-            # iterate through and pull the timeframes
-            temp_trends = self.pull_timeframe(date_start=dd[0],date_end=dd[1])
+        # Get all the separate time frames (timechunks makes the intervals)
+        pull = lambda dd: self.pull_timeframe(date_start=dd[0],date_end=dd[1])
+        if isinstance(self.pytrend, SessionPool) and self.pytrend.size>1:
+            # one timechunk per session at once
+            with ThreadPoolExecutor(max_workers=self.pytrend.size) as pool:
+                frames = list(pool.map(pull, self.timechunks))
+        else:
+            frames = list(map(pull, self.timechunks))
+        if self.hierarchical:
+            # Terms the tree could not link in some timechunk are NaN there
+            self.unlinked = [kw for kw in self.kw_list
+                             if any(ff[kw].isna().all() for ff in frames)]
+            if self.unlinked:
+                print('Left out of the index, too rarely searched to link: %s'
+                      %', '.join(self.unlinked))
+                self.kw_list = [kw for kw in self.kw_list if kw not in self.unlinked]
+                frames = [ff[self.kw_list] for ff in frames]
+        for ii, temp_trends in enumerate(frames):
             self.raw_trends[ii] = temp_trends.copy()
             if ii==0:
                 trends = temp_trends.copy()
@@ -224,10 +285,10 @@ class Trendex:
 
                 for jj in temp_trends.columns:
                     # adjust the following parts to have the same overlap mean
-                    temp_trends.loc[:,jj] = temp_trends.loc[:,jj].values*meanadj[jj]
+                    temp_trends[jj] = temp_trends[jj].values*meanadj[jj]
 
                 # append the new part
-                trends = trends.append(temp_trends.iloc[self.overlap+1:]).copy()
+                trends = pd.concat([trends,temp_trends.iloc[self.overlap+1:]]).copy()
 
         # Save the adjusted trends too
         self.raw_trends_adjusted = trends.copy()
@@ -268,7 +329,8 @@ class Trendex:
 
         return self
 
-    def pull_timeframe(self, date_start=None, date_end=None):
+    def pull_timeframe(self, date_start=None, date_end=None, timeframe=None,
+                       keep_partial=False):
         """
         This function pulls data from a set timeframe for all variables in kw_list.
         The outcome will be hourly, weekly, or monthly depending on the length
@@ -291,6 +353,13 @@ class Trendex:
             Date in %y-%m-%d format. The default is date_start.
         date_end: str, optional
             Date in %y-%m-%d format. The default is date_end.
+        timeframe: str, optional
+            Any Trends timeframe (e.g. 'now 7-d'). If given, it is used
+            instead of date_start and date_end.
+        keep_partial: boolean, optional
+            If True then keep the rows Trends flags as partial, and only warn
+            about a benchmark that is 0 more than nowcast_tol of the time, since
+            hourly data has many zeros. The default is False, which drops them.
 
         Raises
         ------
@@ -310,24 +379,29 @@ class Trendex:
             date_start = self.date_start
         if not date_end:
             date_end = self.date_end
+        if not timeframe:
+            timeframe = '%s %s' %(date_start,date_end)
 
         small_dum = False
 
-        if self.benchmark:
+        if self.hierarchical:
+            tree = BenchmarkTree(self.kw_list,self.geo,timeframe,self.pytrend,
+                                 slowdown=self.slowdown,keep_partial=keep_partial)
+            # the index needs every term, so the whole tree is read back here
+            frame = tree.build().trends()[self.kw_list]
+
+        elif self.benchmark:
             # Do the searches in batches
             # For each one initial transform and spit into dictionary of dataframes
-            for idx, ss in enumerate(self.search_groups):
-                if self.slowdown:
-                    time.sleep(round(random()*4+2,2)) # sleep it so no timeout
-                # Do the search
-                self.pytrend.build_payload(ss,geo=self.geo,
-                                      timeframe='%s %s' %(date_start,
-                                                          date_end))
-                df = self.pytrend.interest_over_time()
+            frames = self.pull_groups(self.search_groups,timeframe)
+            for idx, (ss, df) in enumerate(zip(self.search_groups,frames)):
                 df = df.copy()
 
                 # Warn and stop if benchmark sucks
-                if not self.benchmark_select:
+                if keep_partial:
+                    if df[self.benchmark].eq(0).mean()>self.nowcast_tol:
+                        small_dum = True
+                elif not self.benchmark_select:
                     if self.too_small(df[self.benchmark]):
                         raise ValueError('The benchmark has too many 0 or small values. '\
                                          'Please choose a different first search term '\
@@ -338,7 +412,10 @@ class Trendex:
                         small_dum = True
 
                 # Get rid of partial days
-                df = df.loc[df.isPartial.astype('str').eq('False'),ss]
+                if keep_partial:
+                    df = df.loc[:,ss]
+                else:
+                    df = df.loc[df.isPartial.astype('str').eq('False'),ss]
 
                 # Just in case replace 0 values in the benchmark with 1's
                 df[self.benchmark] = df[self.benchmark].replace({0:1})
@@ -354,21 +431,149 @@ class Trendex:
                     frame = frame.join(df.drop(self.benchmark,axis=1).copy()).copy()
 
         else:
-            self.pytrend.build_payload(self.kw_list,geo=self.geo,
-                                  timeframe='%s %s' %(date_start,date_end))
+            self.pytrend.build_payload(self.kw_list,geo=self.geo,timeframe=timeframe)
             df = self.pytrend.interest_over_time()
-            frame = df.loc[df.isPartial.astype('str').eq('False'),self.kw_list]
+            if keep_partial:
+                frame = df.loc[:,self.kw_list]
+            else:
+                frame = df.loc[df.isPartial.astype('str').eq('False'),self.kw_list]
 
         if small_dum:
             print('Benchmark term %s is optimal, but performs '\
-                  'poorly between %s and %s' %(self.benchmark,date_start,date_end))
+                  'poorly over %s' %(self.benchmark,timeframe))
 
         return frame
 
+    def pull_groups(self, groups, timeframe, slowdown=None):
+        """
+        Run one payload per search group, returning the dataframes in order.
+
+        On a pool of more than one session the groups are independent payloads,
+        so they all go out at once, one per free session; the pool keeps the
+        pace. Otherwise they run one after the other, sleeping in between if
+        slowdown (by default self.slowdown).
+        """
+        if isinstance(self.pytrend, SessionPool) and self.pytrend.size>1:
+            return self.pytrend.fetch_many([{'kw_list':ss,'geo':self.geo,
+                                             'timeframe':timeframe} for ss in groups])
+        if slowdown is None:
+            slowdown = self.slowdown
+        frames = []
+        for ss in groups:
+            if slowdown:
+                time.sleep(round(random()*4+2,2)) # sleep it so no timeout
+            # Do the search
+            self.pytrend.build_payload(ss,geo=self.geo,timeframe=timeframe)
+            frames.append(self.pytrend.interest_over_time())
+        return frames
+
+    def nowcast(self, timeframe=None):
+        """
+        Append provisional values for the days the daily index does not cover yet.
+
+        Daily searches only return complete days, so the index lags by a day or
+        more. This pulls recent hourly data (one payload per search group),
+        averages it into days, scales it onto the daily data through the days
+        both cover, and appends the days after the end of the index, including
+        the current partial day. History is left as is, so it can be rerun
+        every hour to refresh the provisional values at the cost of the hourly
+        payloads alone.
+
+        Hours come back in UTC while days are in the client's tz, so the hours
+        are shifted by tz before they are averaged. The current day only has
+        the hours up to now, so it is scaled by how the whole day compared to
+        the same hours on the complete days of the window.
+
+        Parameters
+        ----------
+        timeframe: str, optional
+            A Trends timeframe returning hourly data that overlaps the end of
+            the daily index. The default is nowcast_timeframe ('now 7-d').
+
+        Raises
+        ------
+        ValueError
+            If the index is not daily, has not been made yet, or does not
+            overlap the hourly data.
+
+        Returns (back to class instance)
+        -------
+        self.gti_nowcast: Series
+            The index with the provisional days appended.
+
+        self.nowcast_trends: Dataframe
+            The provisional daily values for each term.
+
+        self.nowcast_factors: Series
+            The factor applied to each term, computed like adjustment_factors.
+
+        """
+        if self.frequency != 'daily':
+            raise ValueError('Nowcasts are only available for daily indices.')
+        if self.raw_trends_adjusted is None:
+            raise ValueError('Run make_index() before nowcast().')
+        if not timeframe:
+            timeframe = self.nowcast_timeframe
+
+        hourly = self.pull_timeframe(timeframe=timeframe,keep_partial=True)
+        # Hours are stamped in UTC, days are in the tz of the client
+        tz = getattr(self.pytrend,'tz',None)
+        if tz:
+            hourly.index = hourly.index - pd.Timedelta(minutes=tz)
+
+        # Average hours into days; the first day is cut short by the window, drop it
+        day = hourly.index.normalize()
+        daily = hourly.groupby(day).mean()
+        first, today = daily.index.min(), daily.index.max()
+        daily = daily.loc[daily.index>first]
+
+        # Scale today up by how whole days compare to their hours up to now
+        seen = hourly.index.hour<=hourly.index[-1].hour
+        early = hourly.loc[seen].groupby(day[seen]).mean()
+        complete = daily.index[daily.index<today]
+        full_sum, early_sum = daily.loc[complete].sum(), early.loc[complete].sum()
+        daily.loc[today] = daily.loc[today]*(full_sum/early_sum).where(early_sum>0,1)
+
+        history = self.raw_trends_adjusted
+        meanadj = history.join(daily,how='inner',
+                               lsuffix='_1',rsuffix='_2').replace({0:1})
+        if meanadj.empty:
+            raise ValueError('The hourly data does not overlap the daily index, '\
+                             'rerun make_index() with a later date_end.')
+        for jj in daily.columns:
+            meanadj['%s' %jj] = meanadj['%s_1' %jj]/meanadj['%s_2' %jj]
+            meanadj = meanadj.drop(columns=['%s_1' %jj,'%s_2' %jj])
+        meanadj = meanadj.mean()
+
+        provisional = daily.loc[daily.index>history.index.max()]*meanadj
+        self.nowcast_factors = meanadj.copy()
+        self.nowcast_trends = provisional.copy()
+
+        # Put the new days on the scale of gti without recomputing it
+        total = history.sum(axis=1)
+        new = provisional.sum(axis=1)
+        if self.seasonal:
+            base = self.sadjust(total)
+            # the daily seasonal component is weekly, reuse the last one per weekday
+            lastweek = (total-base).iloc[-7:]
+            lastweek.index = lastweek.index.dayofweek
+            new = new - lastweek.reindex(new.index.dayofweek).values
+        else:
+            base = total
+        new = (new-base.mean())/base.std()
+
+        self.gti_nowcast = pd.concat([self.gti,new]).rename('GTI')
+
+        return self
+
 
     def get_benchmark(self):
+        # The tree picks its own benchmarks for each timeframe
+        if self.hierarchical:
+            benchmark = None
+            search_groups = None
         # Limit on google trends searches is 5 words else need benchmark term
-        if len(self.kw_list) > 5 and not self.benchmark_select:
+        elif len(self.kw_list) > 5 and not self.benchmark_select:
             benchmark = self.kw_list[0]
             search_groups = list(self.chunks(self.kw_list))
         elif len(self.kw_list) > 5 and self.benchmark_select:
@@ -455,10 +660,9 @@ class Trendex:
 
         chunks = list(self.chunks([popterm]+self.kw_list))
 
-        for index,chunk in enumerate(chunks):
-            self.pytrend.build_payload(chunk,geo=self.geo,
-                                  timeframe='%s %s' %(self.date_start,self.date_end))
-            temp = self.pytrend.interest_over_time()
+        temps = self.pull_groups(chunks,'%s %s' %(self.date_start,self.date_end),
+                                 slowdown=False)
+        for index,(chunk,temp) in enumerate(zip(chunks,temps)):
             temp = temp.loc[temp.isPartial.astype('str').eq('False'),chunk].drop(columns=popterm)
 
             if index==0:
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Hierarchical benchmarking for very long keyword lists.
+
+A single benchmark term has to share every payload with 4 keywords, and low
+volume keywords lose precision when they are all rescaled through it. Instead,
+the keywords are searched in groups of 5 and the most searched term of each
+group becomes its anchor. The anchors are searched in groups of 5 in turn, and
+so on up to a single root group, so that every group is scaled to its parent
+through the anchor they share. That is N/4 payloads for N keywords at least,
+the same as a flat benchmark, without "+" merging.
+
+Trends rounds every payload to integers out of 100, so a term averaging less
+than min_mean next to the top term of its payload is not measured well, and
+neither is anything scaled through it. Such terms are never linked through:
+  - a weak keyword is searched again with the smallest well measured term of
+    its payload as an intermediate benchmark; if there is none, it goes back to
+    the end of the stream and is grouped with the other low volume keywords.
+  - a weak anchor is left out of its parent group. The groups left out are
+    linked among themselves and the top of them is linked to the tree through
+    a term of similar volume (the "ladder", one well measured term of the tree
+    per half order of magnitude).
+Every weak keyword costs about a quarter payload more, so the cost grows with
+the spread of volumes. Searching keywords at random volumes with the default
+min_mean=5 takes about N/4 payloads within one order of magnitude, 1.7 N/4
+over two, 2.2 N/4 over three and 3 N/4 over five. min_mean=0 only searches
+again the keywords that round to 0 everywhere: N/4 over up to two orders of
+magnitude, 1.4 N/4 over three and 2 N/4 over five, at the cost of the
+precision of the low volume keywords.
+
+The tree is built while the keywords stream in: a group is searched as soon as
+it is full and the searched groups are written to disk and read back one at a
+time. What stays in memory is the set of keywords seen so far (to skip
+duplicates), the weak keywords waiting to be grouped again, one partial group
+per level, the groups left out of their parent and the ladder.
+"""
+# =============================================================================
+# Imports
+# =============================================================================
+import math
+import os
+import tempfile
+import time
+from collections import deque
+from itertools import islice
+import pandas as pd
+from numpy.random import random
+from pytrendex.sessions import SessionPool
+
+
+class BenchmarkTree:
+    """
+    A tree of benchmarks linking the groups of a long keyword list.
+
+    Parameters
+    ----------
+    kw_list: iterable
+        The keywords, as a list or any iterable (a generator, an open file
+        with one keyword per line, ...). Duplicates and blanks are skipped.
+
+    geo: str
+        The country or place the search is conducted in, see Trends documentation.
+
+    timeframe: str
+        The Trends timeframe, e.g. '2019-01-01 2019-09-01'.
+
+    pytrend: TrendReq or SessionPool
+        The client to run the searches with. On a SessionPool the leaf groups
+        are searched as many at once as it has sessions.
+
+    group_size: int, optional
+        Terms per payload, 5 being the most Trends allows. Default is 5.
+
+    min_mean: float, optional
+        Terms averaging less than this (out of 100) in a payload are not
+        measured well there, and are searched again or regrouped. Default is 5,
+        0 only sets aside terms with no searches at all, for the fewest payloads.
+
+    spill_dir: str, optional
+        Where the leaf groups are kept until the tree is done. If none provided
+        then a temporary directory, removed with the tree.
+
+    slowdown: boolean, optional
+        If True then sleep between payloads, as Trendex does. Default is True.
+
+    keep_partial: boolean, optional
+        If True then keep the rows Trends flags as partial. Default is False.
+
+    Returns (back to class instance, after build)
+    -------
+    self.requests: int
+        The number of payloads the tree took.
+
+    self.factors: Dictionary
+        For each group, its parent group and the factor scaling it to the parent.
+
+    self.unlinked: list
+        Keywords with searches that could not be put on the scale of the root,
+        because they are mostly 0 next to every term of the tree. They are NaN
+        in the trends.
+
+    """
+    def __init__(self, kw_list, geo, timeframe, pytrend, group_size=5, min_mean=5,
+                 spill_dir=None, slowdown=True, keep_partial=False):
+        self.kw_list = kw_list
+        self.geo = geo
+        self.timeframe = timeframe
+        self.pytrend = pytrend
+        self.group_size = group_size
+        self.min_mean = min_mean
+        self.slowdown = slowdown
+        self.keep_partial = keep_partial
+        if spill_dir is None:
+            self._tmpdir = tempfile.TemporaryDirectory(prefix='pytrendex_')
+            spill_dir = self._tmpdir.name
+        self.spill_dir = spill_dir
+
+        self.requests = 0
+        self.factors = {}
+        self.leaves = []
+        self.root = None
+        self.unlinked = []
+        self._nodes = 0
+        self._low = deque()
+        self._orphans = []
+        # independent payloads go out together, one per session
+        self.batch = pytrend.size if isinstance(pytrend, SessionPool) else 1
+
+    def __repr__(self) -> str:
+        if self.root is None:
+            return 'A benchmark tree. Run build() to search the groups'
+        return 'A benchmark tree of %s groups, built with %s payloads'\
+            %(len(self.leaves), self.requests)
+
+    def build(self):
+        """Search every group, linking them level by level up to the root."""
+        self.root = self.grow(self.leaf_nodes())
+        if self.root is None:
+            raise ValueError('None of the keywords has any search volume.')
+
+        # Groups too small to link through their parent are linked among
+        # themselves, then to the tree through a term of similar volume
+        ladder = None
+        while self._orphans:
+            orphans = self._orphans
+            self._orphans = []
+            if ladder is None:
+                ladder = self.ladder()
+            self.link(self.grow(orphans), ladder)
+
+        self.unlinked = [kw for node, _, terms in self.leaves
+                         if node is not None and self.scale(node) is None
+                         for kw in terms]
+        return self
+
+    def grow(self, nodes):
+        """Link nodes level by level into a tree, returning its root."""
+        levels = []
+        for node in nodes:
+            self.push(levels, 0, node)
+
+        # Link what is left in each level, from the bottom up
+        level = 0
+        while level < len(levels):
+            waiting = levels[level]
+            levels[level] = []
+            higher = any(levels[level+1:])
+            if len(waiting) == 1 and not higher:
+                return waiting[0]
+            elif len(waiting) == 1:
+                # nothing to link it to here, hand it up as is
+                self.push(levels, level+1, waiting[0])
+            elif waiting:
+                self.push(levels, level+1, self.pull_parent(waiting))
+            level += 1
+        return None
+
+    def groups(self):
+        """Yield the keywords in groups of group_size, in the order given."""
+        seen = set()
+        group = []
+        for kw in self.kw_list:
+            kw = kw.strip()
+            if not kw or kw in seen:
+                continue
+            seen.add(kw)
+            group.append(kw)
+            if len(group) == self.group_size:
+                yield group
+                group = []
+        if group:
+            yield group
+
+    def leaf_nodes(self):
+        """
+        Search the groups, as many at once as the client has sessions, yielding
+        the nodes with any volume. Once the stream is done, the weak keywords
+        set aside on the way are grouped among themselves; searching these can
+        set more aside, each time fewer.
+        """
+        stream = self.groups()
+        while True:
+            batch = list(islice(stream, self.batch))
+            if not batch:
+                low = [self._low.popleft() for _ in
+                       range(min(len(self._low), self.batch*self.group_size))]
+                batch = [low[ii:ii+self.group_size]
+                         for ii in range(0, len(low), self.group_size)]
+            if not batch:
+                return
+            for group, df in zip(batch, self.pull_many(batch)):
+                node = self.pull_leaf(group, df)
+                if node is not None:
+                    yield node
+
+    def push(self, levels, level, node):
+        """Add a node to a level, searching the level's group once it is full."""
+        while len(levels) <= level:
+            levels.append([])
+        levels[level].append(node)
+        if len(levels[level]) == self.group_size:
+            children = levels[level]
+            levels[level] = []
+            self.push(levels, level+1, self.pull_parent(children))
+
+    def pull_leaf(self, group, df):
+        """Measure a searched group and spill it to disk, returning its node."""
+        path = os.path.join(self.spill_dir, 'group_%s.pkl' %len(self.leaves))
+        if df.empty or not df.to_numpy().any():
+            # no volume at all, nothing to link it through
+            df.to_pickle(path)
+            self.leaves.append((None, path, list(df.columns)))
+            return None
+        df, weak = self.measure(df)
+        self._low.extend(weak)
+        df.to_pickle(path)
+        node = self.new_node(df)
+        self.leaves.append((node[0], path, list(df.columns)))
+        return node
+
+    def pull_parent(self, children):
+        """Search the anchors of the children together and scale each to it."""
+        df, weak = self.measure(self.pull([anchor for _, anchor, _ in children]))
+        parent = self.new_node(df)
+        for node, anchor, series in children:
+            if anchor in weak:
+                # any factor through it would be mostly rounding
+                self._orphans.append((node, anchor, series))
+            else:
+                self.factors[node] = (parent[0], self.ratio(df[anchor], series))
+        return parent
+
+    def ladder(self):
+        """
+        Well measured terms of the tree, one per half order of magnitude of
+        volume, on the scale of the root and from the smallest up.
+        """
+        rungs = {}
+        for node, path, _ in self.leaves:
+            factor = self.scale(node)
+            if factor is None:
+                continue
+            df = pd.read_pickle(path)*factor
+            for kw, mean in df.mean().items():
+                if mean > 0:
+                    rungs.setdefault(math.floor(2*math.log10(mean)), (kw, df[kw]))
+        return [rungs[rung] for rung in sorted(rungs)]
+
+    def link(self, node, ladder):
+        """
+        Link a node to the root through the smallest rung of the ladder that is
+        measured well next to its anchor. If the anchor falls between two rungs
+        far apart, it is linked through the upper one unless it is mostly 0 there.
+        """
+        child, anchor, series = node
+        for kw, rung in ladder:
+            df = self.pull([kw, anchor])
+            if df.empty:
+                continue
+            top = df.mean().idxmax()
+            if kw != top and df[kw].mean() < self.min_mean:
+                continue # too small next to the anchor, try a bigger one
+            if anchor != top and df[anchor].mean() < self.min_mean \
+                    and df[anchor].eq(0).mean() > .5:
+                return # no rung is closer, and next to this one it is mostly 0
+            middle = self.new_node(df)
+            self.factors[middle[0]] = (self.root[0], self.ratio(rung, df[kw]))
+            self.factors[child] = (middle[0], self.ratio(df[anchor], series))
+            return
+
+    def new_node(self, df):
+        """A node is its id, its anchor (the most searched term) and its series."""
+        anchor = df.mean().idxmax()
+        self._nodes += 1
+        return (self._nodes, anchor, df[anchor].copy())
+
+    def pull(self, terms):
+        """Run a single payload for terms."""
+        if self.slowdown:
+            time.sleep(round(random()*4+2,2)) # sleep it so no timeout
+        self.pytrend.build_payload(terms,geo=self.geo,timeframe=self.timeframe)
+        return self.clean(self.pytrend.interest_over_time(), terms)
+
+    def pull_many(self, groups):
+        """Run one payload per group, at once on a pool of sessions."""
+        if self.batch == 1:
+            return [self.pull(group) for group in groups]
+        frames = self.pytrend.fetch_many([{'kw_list':group,'geo':self.geo,
+                                           'timeframe':self.timeframe}
+                                          for group in groups])
+        return [self.clean(df, group) for df, group in zip(frames, groups)]
+
+    def clean(self, df, terms):
+        """Count the payload and keep the terms' columns, as floats."""
+        self.requests += 1
+        if df.empty:
+            return pd.DataFrame(columns=terms,dtype=float)
+        if self.keep_partial:
+            df = df.loc[:,terms]
+        else:
+            df = df.loc[df.isPartial.astype('str').eq('False'),terms]
+        return df.astype(float)
+
+    def measure(self, df):
+        """
+        Split a payload into the terms it measures well and the ones it does not.
+
+        The top term is always measured. Terms averaging less than min_mean, or
+        nothing, are searched again against the smallest well measured term of
+        df that is not its top, so every step zooms in, and scaled back onto df
+        through it. Returns df with the measured terms only, and the others.
+        """
+        if df.empty or not df.to_numpy().any():
+            return df.iloc[:,:0], list(df.columns)
+        means = df.mean()
+        top = means.idxmax()
+        weak = [kw for kw in df.columns
+                if kw != top and (means[kw] < self.min_mean or means[kw] == 0)]
+        bridges = means.drop(weak+[top])
+        if not weak or bridges.empty:
+            return df.drop(columns=weak), weak
+
+        bridge = bridges.idxmin()
+        unresolved = []
+        for ii in range(0, len(weak), self.group_size-1):
+            chunk = weak[ii:ii+self.group_size-1]
+            finer, left = self.measure(self.pull([bridge]+chunk))
+            if bridge not in finer or not finer[bridge].any():
+                unresolved += chunk
+                continue
+            factor = self.ratio(df[bridge], finer[bridge])
+            found = [kw for kw in chunk if kw in finer]
+            df[found] = (finer[found]*factor).reindex(df.index)
+            unresolved += left
+        return df.drop(columns=unresolved), unresolved
+
+    @staticmethod
+    def ratio(big, small):
+        """
+        The factor taking small onto the scale of big, over the dates both
+        cover. A ratio of sums, as zeros make a mean of daily ratios meaningless.
+        """
+        adjframe = pd.concat([big, small],axis=1,join='inner')
+        return adjframe.iloc[:,0].sum()/adjframe.iloc[:,1].sum()
+
+    def scale(self, node):
+        """The factor taking a group onto the scale of the root, None if unlinked."""
+        factor = 1.
+        while node != self.root[0]:
+            if node not in self.factors:
+                return None
+            node, step = self.factors[node]
+            factor *= step
+        return factor
+
+    def iter_trends(self):
+        """Yield each group of keywords, scaled to the root, one at a time."""
+        if self.root is None:
+            raise ValueError('Run build() before reading the trends.')
+        index = self.root[2].index
+        for node, path, _ in self.leaves:
+            df = pd.read_pickle(path)
+            if node is None:
+                yield df.reindex(index).fillna(0)
+            elif self.scale(node) is None:
+                yield df*float('nan')
+            else:
+                yield df*self.scale(node)
+
+    def trends(self):
+        """All the keywords, scaled to the root, in one dataframe."""
+        return pd.concat(self.iter_trends(),axis=1)
+
+    def total(self):
+        """The sum of all the scaled keywords, without holding them all at once."""
+        total = None
+        for df in self.iter_trends():
+            part = df.sum(axis=1)
+            total = part if total is None else total.add(part,fill_value=0)
+        return total
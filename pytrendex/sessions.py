@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A pool of pytrends sessions for running Trends payloads in parallel.
+
+Every session is its own TrendReq client, with its own proxies, cookies,
+timeout and retry policy, so the pool can go as fast as the number of client
+identities allows. Payloads are handed to the healthy session that has been
+idle the longest. A session that errors is rested, for twice as long after
+each consecutive error, and the payload is retried on another session.
+
+The pool has the build_payload / interest_over_time methods Trendex uses, so it
+can be passed straight in as its pytrend:
+
+    pool = SessionPool([{'proxies': ['https://10.0.0.1:8080']},
+                        {'proxies': ['https://10.0.0.2:8080']}])
+    result = Trendex(kw_list, 'US', pytrend=pool)
+"""
+# =============================================================================
+# Imports
+# =============================================================================
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from numpy.random import random
+from requests.exceptions import RequestException
+
+# An unofficial google trends API
+from pytrends.request import TrendReq
+from pytrends.exceptions import ResponseError
+
+# Responses that mean the session, not the payload, is in trouble
+TOO_MANY_REQUESTS = 429
+
+
+class Session:
+    """One client of the pool and its health record."""
+    def __init__(self, name, client, pace):
+        self.name = name
+        self.client = client
+        self.pace = pace
+        self.busy = False
+        self.next_free = 0. # earliest time the next request may go out
+        self.rest_until = 0. # resting after errors until then
+        self.errors = 0 # consecutive errors
+        self.requests = 0
+        self.failures = 0
+
+    def __repr__(self) -> str:
+        return 'Session %s: %s requests, %s failures' %(self.name, self.requests,
+                                                        self.failures)
+
+
+class SessionPool:
+    """
+    A health-aware pool of pytrends sessions.
+
+    Parameters
+    ----------
+    sessions: list, optional
+        One dict per session with the arguments of its TrendReq, e.g. proxies,
+        timeout, retries, backoff_factor or requests_args (for cookies and
+        headers). A session may also set its own 'pace' and 'name'.
+        The default is a single session without a proxy.
+
+    pace: float, optional
+        Minimum number of seconds between two requests of the same session.
+        Default is 6.
+
+    jitter: float, optional
+        Extra random wait of up to this many seconds on top of the pace, so
+        that requests do not arrive on a fixed clock. Default is 2.
+
+    rest: float, optional
+        Seconds a session rests after an error, doubled for each consecutive
+        error up to max_rest. Default is 60.
+
+    max_rest: float, optional
+        Longest rest for a session, in seconds. Default is 900.
+
+    attempts: int, optional
+        How many times a payload is tried, each time on the best session
+        available, before the error is raised. Only transport errors and
+        429 (too many requests) responses count against a session and are
+        tried again; other errors, such as a bad payload, are raised at once.
+        Default is 3.
+
+    factory: callable, optional
+        Builds a client from a session's arguments. Default is TrendReq with
+        tz=300 (EST). Pass a stand-in client to run against a local server.
+
+    """
+    def __init__(self, sessions=None, pace=6, jitter=2, rest=60, max_rest=900,
+                 attempts=3, factory=None):
+        if attempts < 1:
+            raise ValueError('A payload needs at least 1 attempt.')
+        if factory is None:
+            factory = self.trendreq
+        self.jitter = jitter
+        self.rest = rest
+        self.max_rest = max_rest
+        self.attempts = attempts
+        self.sessions = []
+        for ii, config in enumerate(sessions or [{}]):
+            config = dict(config)
+            name = config.pop('name', str(ii))
+            session_pace = config.pop('pace', pace)
+            self.sessions.append(Session(name, factory(**config), session_pace))
+        # pytrends gives daily rows in the client's tz, so sessions must agree on it
+        tzs = set(getattr(ss.client, 'tz', None) for ss in self.sessions)
+        if len(tzs) > 1:
+            raise ValueError('The sessions of a pool must share the same tz.')
+        self.tz = tzs.pop()
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    def __repr__(self) -> str:
+        return 'A pool of %s pytrends sessions, %s healthy' %(self.size,
+                                                              self.healthy)
+
+    @property
+    def size(self):
+        return len(self.sessions)
+
+    @property
+    def healthy(self):
+        """Number of sessions that are not resting after errors."""
+        now = time.monotonic()
+        return sum(ss.rest_until <= now for ss in self.sessions)
+
+    def build_payload(self, kw_list, **kwargs):
+        """Store the payload for this thread, like TrendReq.build_payload."""
+        self._local.payload = (kw_list, kwargs)
+
+    def interest_over_time(self):
+        """Run this thread's payload on a session of the pool."""
+        kw_list, kwargs = self._local.payload
+        return self.fetch(kw_list, **kwargs)
+
+    def fetch(self, kw_list, **kwargs):
+        """
+        Run a single payload and return its interest over time.
+
+        Parameters
+        ----------
+        kw_list: list
+            Up to 5 search terms.
+        kwargs:
+            The other arguments of TrendReq.build_payload (geo, timeframe, ...).
+
+        Raises
+        ------
+        The last session error, if every attempt failed.
+
+        """
+        for attempt in range(self.attempts):
+            session = self.acquire()
+            try:
+                session.client.build_payload(kw_list, **kwargs)
+                df = session.client.interest_over_time()
+            except Exception as e:
+                if not self.session_error(e):
+                    # not the session's fault, do not rest it
+                    self.release(session)
+                    raise
+                self.release(session, failed=True)
+                error = e
+            else:
+                self.release(session)
+                return df
+        raise error
+
+    def fetch_many(self, payloads):
+        """
+        Run many payloads at once, one per free session, in the order given.
+
+        Parameters
+        ----------
+        payloads: list
+            Dicts with kw_list and the other build_payload arguments.
+
+        Returns
+        -------
+        A list of dataframes, one per payload.
+
+        """
+        with ThreadPoolExecutor(max_workers=self.size) as pool:
+            return list(pool.map(lambda pp: self.fetch(**pp), payloads))
+
+    def acquire(self):
+        """Wait for the best session to be free and reserve it."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                free = [ss for ss in self.sessions
+                        if not ss.busy and ss.rest_until <= now]
+                if free:
+                    session = min(free, key=lambda ss: ss.next_free)
+                    session.busy = True
+                    break
+                # wake up when a session ends its rest or is released
+                resting = [ss.rest_until - now for ss in self.sessions if not ss.busy]
+                self._cond.wait(min(resting) if resting else None)
+        # keep to the session's pace outside of the lock
+        wait = session.next_free - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        return session
+
+    def release(self, session, failed=False):
+        """Hand a session back, resting it if its request failed."""
+        with self._cond:
+            now = time.monotonic()
+            session.busy = False
+            session.requests += 1
+            session.next_free = now + session.pace + round(random()*self.jitter, 2)
+            if failed:
+                session.failures += 1
+                session.errors += 1
+                session.rest_until = now + min(self.rest*2**(session.errors-1),
+                                               self.max_rest)
+            else:
+                session.errors = 0
+            self._cond.notify_all()
+
+    @staticmethod
+    def session_error(error):
+        """True if error means the session is in trouble rather than the payload."""
+        if isinstance(error, RequestException):
+            return True
+        if isinstance(error, ResponseError):
+            response = getattr(error, 'response', None)
+            return getattr(response, 'status_code', None) == TOO_MANY_REQUESTS
+        return False
+
+    @staticmethod
+    def trendreq(proxies=None, **kwargs):
+        """Default factory: a TrendReq in EST, proxies may be a single string."""
+        if isinstance(proxies, str):
+            proxies = [proxies]
+        # job files give (connect, read) timeouts as lists, requests wants a tuple
+        if isinstance(kwargs.get('timeout'), list):
+            kwargs['timeout'] = tuple(kwargs['timeout'])
+        kwargs.setdefault('tz', 300)
+        return TrendReq(proxies=proxies or '', **kwargs)
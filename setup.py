@@ -30,6 +30,8 @@ setup(
         'Programming Language :: Python :: 3.7',
         ],
     install_requires=['pytrends','requests','numpy','statsmodels','pandas>=0.25', 'lxml','matplotlib'],
+    extras_require={'cli': ['pyyaml', 'pyarrow']},
     python_requires='>=3',
-    packages=find_packages()
+    packages=find_packages(),
+    entry_points={'console_scripts': ['pytrendex=pytrendex.cli:main']}
 )
@@ -0,0 +1,5 @@
+# Trendex builds a TrendReq when pytrendex is imported, which asks Google for a
+# cookie; the tests only ever talk to stand-ins, so skip it.
+from pytrends.request import TrendReq
+
+TrendReq.GetGoogleCookie = lambda self: {}
@@ -0,0 +1,140 @@
+"""Stand-ins for the Trends backend, so the tests never reach Google."""
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import requests
+from pytrends.exceptions import ResponseError, TooManyRequestsError
+
+
+def wave(level, period=5):
+    """A search volume that moves around level from day to day."""
+    return lambda times: level*(1 + .3*np.sin(times.dayofyear/period))
+
+
+class StubTrendReq:
+    """
+    Answers payloads like TrendReq, from known search volumes.
+
+    volumes maps each term to a number or to a function of local hourly times.
+    Each payload is scaled so that its top value is 100 and rounded, as Trends
+    does. Daily rows are local calendar days, hourly rows are stamped in UTC.
+    """
+    def __init__(self, volumes, now='2020-04-10 10:00', tz=300, **kwargs):
+        self.volumes = volumes
+        self.now = pd.Timestamp(now)
+        self.tz = tz
+        self.payloads = []
+
+    def build_payload(self, kw_list, cat=0, timeframe='today 5-y', geo='', gprop=''):
+        self.kw_list = list(kw_list)
+        self.timeframe = timeframe
+
+    def values(self, kw, times):
+        volume = self.volumes[kw]
+        if callable(volume):
+            return np.asarray(volume(times), dtype=float)
+        return np.full(len(times), float(volume))
+
+    def interest_over_time(self):
+        self.payloads.append(list(self.kw_list))
+        hourly = self.timeframe.startswith('now')
+        if hourly:
+            times = pd.date_range(end=self.now.floor('h'), periods=7*24, freq='h')
+        else:
+            start, end = self.timeframe.split()
+            times = pd.date_range(start, pd.Timestamp(end)+pd.Timedelta(hours=23),
+                                  freq='h')
+        frame = pd.DataFrame({kw: self.values(kw, times) for kw in self.kw_list},
+                             index=times)
+        if hourly:
+            frame.index = frame.index + pd.Timedelta(minutes=self.tz)
+        else:
+            frame = frame.resample('D').mean()
+
+        top = frame.to_numpy().max()
+        if top == 0:
+            return pd.DataFrame()
+        df = (100*frame/top).round().astype(int)
+        df.index.name = 'date'
+        df['isPartial'] = False
+        if hourly:
+            df.iloc[-1, -1] = True
+        return df
+
+
+class StandInServer:
+    """
+    A local HTTP server standing in for Trends, to run session pools against.
+
+    Every request takes delay seconds. Clients send their identity in a header;
+    throttled identities get 429 (too many requests) and payloads with the term
+    'bad' get 400.
+    """
+    def __init__(self, delay=.2, throttled=()):
+        self.delay = delay
+        self.throttled = set(throttled)
+        self.hits = Counter()
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                kw_list = parse_qs(urlparse(self.path).query).get('kw', [])
+                identity = self.headers.get('X-Identity')
+                with server._lock:
+                    server.hits[identity] += 1
+                time.sleep(server.delay)
+                if identity in server.throttled:
+                    code, body = 429, {}
+                elif 'bad' in kw_list:
+                    code, body = 400, {}
+                else:
+                    code, body = 200, {kw: [50]*10 for kw in kw_list}
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%s/' %self.httpd.server_port
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class StandInClient:
+    """A client of StandInServer with the TrendReq methods the pool uses."""
+    def __init__(self, url, identity='', timeout=(2, 5), tz=300):
+        self.url = url
+        self.timeout = timeout
+        self.tz = tz
+        self.session = requests.Session()
+        self.session.headers['X-Identity'] = identity
+
+    def build_payload(self, kw_list, cat=0, timeframe='today 5-y', geo='', gprop=''):
+        self.kw_list = list(kw_list)
+
+    def interest_over_time(self):
+        response = self.session.get(self.url, params={'kw': self.kw_list},
+                                    timeout=self.timeout)
+        if response.status_code == 429:
+            raise TooManyRequestsError.from_response(response)
+        if response.status_code != 200:
+            raise ResponseError.from_response(response)
+        df = pd.DataFrame(response.json(),
+                          index=pd.date_range('2020-01-01', periods=10, name='date'))
+        df['isPartial'] = False
+        return df
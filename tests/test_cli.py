@@ -0,0 +1,132 @@
+import json
+
+import pandas as pd
+import pytest
+
+from pytrendex import cli
+from pytrendex.sessions import SessionPool
+from stubs import StubTrendReq, wave
+
+VOLUMES = {'Obama': wave(60), 'Biden': wave(30, period=3), 'Trump': wave(80, period=7)}
+
+GOOD = """
+output_dir: {out}
+format: csv
+workers: 2
+pace: 0
+defaults:
+  geo: US
+  date_start: 2020-01-01
+  date_end: 2020-03-31
+  options:
+    seasonal_adjust: false
+indices:
+  - name: dems
+    kw_list: [Obama, Biden]
+  - name: reps
+    kw_list: [Trump]
+    options:
+      seasonal_adjust: true
+"""
+
+
+def write(tmp_path, text, name='jobs.yaml'):
+    path = tmp_path / name
+    path.write_text(text.format(out=tmp_path / 'out'))
+    return str(path)
+
+
+@pytest.fixture
+def stub_pool(monkeypatch):
+    """Run the command line on stand-in sessions."""
+    def pool(sessions, pace):
+        return SessionPool(sessions, pace=pace, jitter=0,
+                           factory=lambda **kwargs: StubTrendReq(VOLUMES, **kwargs))
+    monkeypatch.setattr(cli, 'SessionPool', pool)
+
+
+def test_load_jobs_fills_defaults(tmp_path):
+    settings, jobs = cli.load_jobs(write(tmp_path, GOOD))
+    assert settings['workers'] == 2 and settings['format'] == 'csv'
+    assert [job['name'] for job in jobs] == ['dems', 'reps']
+    assert jobs[0]['date_start'] == '2020-01-01'
+    assert jobs[0]['options'] == {'seasonal_adjust': False}
+    assert jobs[1]['options'] == {'seasonal_adjust': True}
+
+
+def test_load_jobs_reads_json(tmp_path):
+    spec = [{'name': 'dems', 'kw_list': ['Obama'], 'geo': 'US'}]
+    path = tmp_path / 'jobs.json'
+    path.write_text(json.dumps(spec))
+    settings, jobs = cli.load_jobs(str(path))
+    assert settings['format'] == 'parquet'
+    assert jobs == [{'name': 'dems', 'kw_list': ['Obama'], 'geo': 'US', 'options': {}}]
+
+
+@pytest.mark.parametrize('old, new, message', [
+    ('workers: 2', 'workers: two', 'workers'),
+    ('workers: 2', 'workers: 0', 'workers'),
+    ('pace: 0', 'pace: soon', 'pace'),
+    ('format: csv', 'format: xlsx', 'format'),
+    ('kw_list: [Trump]', 'kw_list: Trump', 'kw_list'),
+    ('kw_list: [Trump]', 'kw_list: []', 'kw_list'),
+    ('    kw_list: [Trump]\n', '    kw_list: [Trump]\n    colour: red\n', 'unknown keys'),
+    ('seasonal_adjust: true', 'bogus: 1', 'unknown options'),
+    ('seasonal_adjust: true', 'pytrend: 1', 'unknown options'),
+    ('    options:\n      seasonal_adjust: true', '    options:', 'mapping'),
+    ('  geo: US', '  geo: [US]', 'geo'),
+    ('  geo: US', '  geo: US\n  frequency: hourly', 'frequency'),
+    ('name: reps', 'name: dems', 'unique'),
+])
+def test_load_jobs_rejects_bad_files(tmp_path, old, new, message):
+    assert old in GOOD
+    with pytest.raises(cli.JobError, match=message):
+        cli.load_jobs(write(tmp_path, GOOD.replace(old, new)))
+
+
+def test_main_builds_every_index(tmp_path, stub_pool, capsys):
+    assert cli.main([write(tmp_path, GOOD)]) == cli.EXIT_OK
+    for name, terms in [('dems', ['Obama', 'Biden']), ('reps', ['Trump'])]:
+        df = pd.read_csv(tmp_path / 'out' / ('%s.csv' %name), index_col=0)
+        assert list(df.columns) == terms + ['GTI']
+        assert len(df) == 91
+    assert '2 of 2 indices built' in capsys.readouterr().out
+
+
+def test_main_only(tmp_path, stub_pool):
+    assert cli.main([write(tmp_path, GOOD), '--only', 'reps']) == cli.EXIT_OK
+    assert [pp.name for pp in (tmp_path / 'out').iterdir()] == ['reps.csv']
+
+
+def test_main_failed_index(tmp_path, stub_pool, capsys):
+    # the stand-in knows no such term, so that index fails and the other one is built
+    path = write(tmp_path, GOOD.replace('[Obama, Biden]', '[Obama, Nobody]'))
+    assert cli.main([path]) == cli.EXIT_FAILED
+    assert (tmp_path / 'out' / 'reps.csv').exists()
+    assert 'Failed: dems' in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('argv', [
+    ['{dir}/missing.yaml'],
+    ['{jobs}', '--workers', '0'],
+    ['{jobs}', '--only', 'nobody'],
+])
+def test_main_bad_job(tmp_path, stub_pool, argv):
+    jobs = write(tmp_path, GOOD)
+    argv = [aa.format(dir=tmp_path, jobs=jobs) for aa in argv]
+    assert cli.main(argv) == cli.EXIT_BAD_JOB
+
+
+def test_main_bad_options_exit_before_running(tmp_path, stub_pool):
+    path = write(tmp_path, GOOD.replace('seasonal_adjust: true', 'bogus: 1'))
+    assert cli.main([path]) == cli.EXIT_BAD_JOB
+    assert not (tmp_path / 'out').exists()
+
+
+def test_main_parquet_without_engine_exits_before_running(tmp_path, stub_pool, monkeypatch):
+    monkeypatch.setattr(cli, 'PARQUET_ENGINE', None)
+    path = write(tmp_path, GOOD.replace('format: csv', 'format: parquet'))
+    assert cli.main([path]) == cli.EXIT_BAD_JOB
+    assert not (tmp_path / 'out').exists()
+    # csv on the command line needs no engine
+    assert cli.main([path, '--format', 'csv', '--only', 'reps']) == cli.EXIT_OK
@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pytrendex import BenchmarkTree, Trendex
+from stubs import StubTrendReq, wave
+
+TIMEFRAME = '2020-01-01 2020-03-31'
+DAYS = pd.date_range('2020-01-01', '2020-03-31')
+
+
+def build(volumes, **kwargs):
+    client = StubTrendReq(volumes)
+    tree = BenchmarkTree(list(volumes), 'US', TIMEFRAME, client, slowdown=False, **kwargs)
+    return tree.build(), client
+
+
+def scaled_to_truth(volumes, df):
+    """Each term's volume in the tree relative to its true volume, 1 for the top."""
+    truth = pd.DataFrame({kw: wave(level)(DAYS) if np.isscalar(level) else level(DAYS)
+                          for kw, level in volumes.items()}, index=DAYS)
+    ratio = df.sum()/truth.sum()
+    return ratio/ratio[truth.mean().idxmax()]
+
+
+def spread(n, orders, seed=0):
+    levels = 10**np.random.default_rng(seed).uniform(0, orders, n)
+    return {'term %s' %ii: wave(level, period=3+ii%7) for ii, level in enumerate(levels)}
+
+
+def test_scales_terms_over_five_orders_of_magnitude():
+    volumes = spread(200, 5)
+    tree, _ = build(volumes)
+    df = tree.trends()
+    assert sorted(df.columns) == sorted(volumes)
+    assert not df.isna().any().any() and tree.unlinked == []
+    ratio = scaled_to_truth(volumes, df)
+    assert (ratio - 1).abs().max() < .05
+
+
+def test_dominant_term_gets_low_terms_regrouped():
+    # no term of the first payload is a bridge down to the small ones
+    volumes = {'big': wave(1000), 'a': wave(50, 3), 'b': wave(40, 4),
+               'c': wave(30, 6), 'd': wave(20, 7)}
+    tree, client = build(volumes)
+    assert client.payloads[:2] == [['big', 'a', 'b', 'c', 'd'], ['a', 'b', 'c', 'd']]
+    ratio = scaled_to_truth(volumes, tree.trends())
+    # one link through a term at about 4 out of 100, then measured among equals
+    assert (ratio - 1).abs().max() < .05
+    assert ratio.drop('big').std() < .005
+
+
+def test_bridge_refines_weak_terms():
+    volumes = {'big': wave(1000), 'mid': wave(200, 3), 'a': wave(20, 4),
+               'b': wave(15, 6), 'c': wave(10, 7)}
+    tree, client = build(volumes)
+    assert client.payloads[1] == ['mid', 'a', 'b', 'c']
+    ratio = scaled_to_truth(volumes, tree.trends())
+    assert (ratio - 1).abs().max() < .02
+
+
+def test_unmeasurable_terms_are_nan_not_zero():
+    volumes = {'big': 1e4, 'a': 50, 'b': 40, 'c': 30, 'd': 20}
+    tree, _ = build(volumes)
+    df = tree.trends()
+    assert tree.unlinked == ['a', 'b', 'c', 'd']
+    assert df[tree.unlinked].isna().all().all()
+    assert df['big'].eq(100).all()
+
+
+def test_payloads_without_refining():
+    volumes = {'term %s' %ii: wave(10+ii, period=3+ii%5) for ii in range(100)}
+    tree, client = build(volumes, min_mean=0)
+    # 20 groups of 5, then their anchors in 4 groups of 5, then the root group
+    assert tree.requests == len(client.payloads) == 25
+    assert all(len(pp) <= 5 for pp in client.payloads)
+
+
+@pytest.mark.parametrize('orders, most', [(1, 1.05), (2, 1.8), (5, 3.3)])
+def test_payloads_grow_with_the_spread_of_volumes(orders, most):
+    volumes = spread(200, orders)
+    tree, _ = build(volumes)
+    cheapest, _ = build(volumes, min_mean=0)
+    assert 50 <= cheapest.requests <= tree.requests <= most*50
+
+
+def test_single_group():
+    volumes = {'Obama': wave(60), 'Biden': wave(30, 3), 'Trump': wave(80, 7)}
+    tree, client = build(volumes)
+    assert tree.requests == 1 and tree.factors == {}
+    expected = client.interest_over_time().drop(columns='isPartial').astype(float)
+    pd.testing.assert_frame_equal(tree.trends()[list(volumes)], expected, check_freq=False)
+
+
+def test_terms_without_volume_are_zero():
+    volumes = dict(spread(12, 2), **{'none %s' %ii: 0 for ii in range(6)})
+    tree, _ = build(volumes)
+    df = tree.trends()
+    assert sorted(df.columns) == sorted(volumes)
+    assert not df.isna().any().any()
+    assert df.filter(like='none').eq(0).all().all()
+    assert df.filter(like='term').gt(0).all().all()
+
+    with pytest.raises(ValueError, match='search volume'):
+        build({'none': 0, 'nothing': 0})
+
+
+def test_many_levels():
+    volumes = spread(60, 3, seed=1)
+    tree, _ = build(volumes)
+    # more than 25 terms: the anchors themselves need a tree
+    parents = {parent for parent, _ in tree.factors.values()}
+    assert any(parent in tree.factors for parent in parents)
+    ratio = scaled_to_truth(volumes, tree.trends())
+    assert (ratio - 1).abs().max() < .05
+
+
+def test_streams_keywords(tmp_path):
+    volumes = spread(30, 2)
+    path = tmp_path / 'vocabulary.txt'
+    path.write_text('\n'.join(list(volumes) + list(volumes)[:5] + ['']))
+    with open(path) as f:
+        tree = BenchmarkTree(f, 'US', TIMEFRAME, StubTrendReq(volumes), slowdown=False,
+                             spill_dir=str(tmp_path)).build()
+    assert len(list(tmp_path.glob('group_*.pkl'))) == len(tree.leaves)
+    total = tree.total()
+    pd.testing.assert_series_equal(total, tree.trends().sum(axis=1), check_freq=False)
+
+
+def test_trendex_hierarchical():
+    volumes = spread(12, 2)
+    result = Trendex(list(volumes), 'US', date_start='2020-01-01', date_end='2020-03-31',
+                     plot=False, slowdown=False, hierarchical=True,
+                     pytrend=StubTrendReq(volumes))
+    assert list(result.trends.columns) == list(volumes)
+    assert not result.trends.isna().any().any()
+
+
+@pytest.mark.parametrize('frequency, date_start', [('daily', '2020-01-01'),
+                                                    ('weekly', '2018-01-01')])
+def test_trendex_hierarchical_leaves_out_unlinked(frequency, date_start, capsys):
+    # a and b are mostly 0 next to any other term
+    volumes = {'big': wave(1e4), 'other': wave(6e3, 3), 'a': 20, 'b': 15}
+    result = Trendex(list(volumes), 'US', date_start=date_start, date_end='2020-03-31',
+                     frequency=frequency, plot=False, slowdown=False, hierarchical=True, pytrend=StubTrendReq(volumes))
+    assert result.unlinked == ['a', 'b']
+    assert result.kw_list == ['big', 'other']
+    assert list(result.trends.columns) == result.kw_list
+    assert not result.trends_sa.isna().any().any() and not result.gti.isna().any()
+    assert 'a, b' in capsys.readouterr().out
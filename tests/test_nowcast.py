@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pytrendex import Trendex, SessionPool
+from stubs import StubTrendReq
+
+TODAY = pd.Timestamp('2020-04-10')
+
+
+def intraday(level, night=0.):
+    """A volume that changes from day to day and over the hours of a (local) day."""
+    def volume(times):
+        daylevel = 1 + .5*((times.dayofyear % 5)/4)
+        # averages to 1 over the whole day; dips to 0 overnight if night=0
+        shape = 1 + np.sin(2*np.pi*(times.hour-9)/24)*(1-night)
+        return level*daylevel*shape
+    return volume
+
+
+VOLUMES = {'Obama': intraday(60), 'Biden': intraday(30), 'Trump': intraday(80)}
+
+
+def make(volumes=VOLUMES, client=None, **kwargs):
+    if client is None:
+        client = StubTrendReq(volumes, now='2020-04-10 10:00')
+    return Trendex(list(volumes), 'US', date_start='2020-01-15', date_end='2020-04-09',
+                   plot=False, slowdown=False, pytrend=client, **kwargs)
+
+
+def expected_ratio():
+    """True volume of today relative to yesterday, the last day of the index."""
+    daylevel = lambda day: 1 + .5*((day.dayofyear % 5)/4)
+    return daylevel(TODAY)/daylevel(TODAY - pd.Timedelta(days=1))
+
+
+@pytest.mark.parametrize('seasonal', [True, False])
+def test_nowcast_appends_today(seasonal):
+    result = make(seasonal_adjust=seasonal)
+    gti = result.gti.copy()
+    history = result.raw_trends_adjusted.copy()
+
+    result.nowcast()
+
+    assert list(result.nowcast_trends.index) == [TODAY]
+    assert list(result.gti_nowcast.index) == list(gti.index) + [TODAY]
+    pd.testing.assert_series_equal(result.gti_nowcast.iloc[:-1], gti, check_freq=False)
+    pd.testing.assert_series_equal(result.gti, gti)
+    pd.testing.assert_frame_equal(result.raw_trends_adjusted, history)
+
+    # the hours are put on the daily scale through the days both cover
+    ratio = result.nowcast_trends.iloc[0]/history.iloc[-1]
+    assert np.allclose(ratio, expected_ratio(), rtol=.03)
+
+
+def test_nowcast_reruns_without_touching_history():
+    client = StubTrendReq(VOLUMES, now='2020-04-10 10:00')
+    result = make(client=client)
+    result.nowcast()
+    payloads = len(client.payloads)
+    client.now = pd.Timestamp('2020-04-10 15:00')
+    result.nowcast()
+
+    # one hourly payload per refresh, same provisional day, similar value
+    assert len(client.payloads) == payloads + 1
+    assert list(result.nowcast_trends.index) == [TODAY]
+    ratio = result.nowcast_trends.iloc[0]/result.raw_trends_adjusted.iloc[-1]
+    assert np.allclose(ratio, expected_ratio(), rtol=.03)
+
+
+def test_nowcast_on_session_pool():
+    pool = SessionPool([{}, {}], pace=0, jitter=0, factory=lambda **kwargs: StubTrendReq(
+        VOLUMES, now='2020-04-10 10:00', **kwargs))
+    assert pool.tz == 300
+    result = make(client=pool).nowcast()
+    ratio = result.nowcast_trends.iloc[0]/result.raw_trends_adjusted.iloc[-1]
+    assert np.allclose(ratio, expected_ratio(), rtol=.03)
+
+
+def test_nowcast_hourly_zeros_in_fixed_benchmark():
+    # the benchmark has no searches overnight, which is fine for an hourly pull
+    volumes = dict({'stock market': intraday(90, night=0)},
+                   **{'term %s' %ii: intraday(20+10*ii, night=.5) for ii in range(5)})
+    result = make(volumes, benchmark_select=False)
+    assert result.benchmark == 'stock market'
+    result.nowcast()
+    assert list(result.nowcast_trends.index) == [TODAY]
+    ratio = result.nowcast_trends.iloc[0]/result.raw_trends_adjusted.iloc[-1]
+    assert np.allclose(ratio, expected_ratio(), rtol=.05)
+
+
+def test_nowcast_needs_a_daily_index():
+    with pytest.raises(ValueError, match='make_index'):
+        make(gen_index=False).nowcast()
+    result = make(gen_index=False)
+    result.frequency = 'weekly'
+    with pytest.raises(ValueError, match='daily'):
+        result.nowcast()
@@ -0,0 +1,171 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+from pytrends.exceptions import ResponseError, TooManyRequestsError
+from requests.exceptions import ConnectionError
+
+from pytrendex import SessionPool, Trendex
+from stubs import StandInClient, StandInServer, StubTrendReq, wave
+
+PAYLOADS = [{'kw_list': ['term %s' %ii]} for ii in range(8)]
+
+
+@pytest.fixture
+def server():
+    server = StandInServer(delay=.2)
+    yield server
+    server.close()
+
+
+def pool_on(server, identities, **kwargs):
+    kwargs.setdefault('pace', 0)
+    kwargs.setdefault('jitter', 0)
+    return SessionPool([{'identity': ii} for ii in identities],
+                       factory=lambda **config: StandInClient(server.url, **config),
+                       **kwargs)
+
+
+def timed(pool, payloads=PAYLOADS):
+    t0 = time.monotonic()
+    frames = pool.fetch_many(payloads)
+    return frames, time.monotonic() - t0
+
+
+def test_throughput_scales_with_sessions(server):
+    frames, one = timed(pool_on(server, ['a']))
+    assert [list(df.columns[:-1]) for df in frames] == [pp['kw_list'] for pp in PAYLOADS]
+    _, four = timed(pool_on(server, ['a', 'b', 'c', 'd']))
+    assert one >= 8*server.delay
+    assert four < one/2.5
+    # every session took part
+    assert sum(server.hits.values()) == 16 and min(server.hits.values()) >= 1
+
+
+def test_pace_spaces_requests_of_a_session(server):
+    _, took = timed(pool_on(server, ['a'], pace=.1), PAYLOADS[:3])
+    assert took >= 3*server.delay + 2*.1
+
+
+def test_throttled_session_rests_and_payload_moves(server):
+    server.throttled = {'throttled'}
+    pool = pool_on(server, ['throttled', 'ok'], rest=60)
+    frames, _ = timed(pool, PAYLOADS[:4])
+    assert len(frames) == 4
+
+    throttled, ok = pool.sessions
+    assert (throttled.failures, throttled.requests) == (1, 1)
+    assert (ok.failures, ok.requests) == (0, 4)
+    assert throttled.rest_until - time.monotonic() == pytest.approx(60, abs=2)
+    assert pool.healthy == 1
+
+
+def test_rest_doubles_up_to_max_rest(server):
+    server.throttled = {'a'}
+    pool = pool_on(server, ['a'], rest=10, max_rest=30, attempts=1)
+    session = pool.sessions[0]
+    for rest in [10, 20, 30, 30]:
+        session.rest_until = 0. # skip the wait
+        with pytest.raises(TooManyRequestsError):
+            pool.fetch(['term'])
+        assert session.rest_until - time.monotonic() == pytest.approx(rest, abs=1)
+
+    # a success clears the record
+    server.throttled = set()
+    session.rest_until = 0.
+    pool.fetch(['term'])
+    assert session.errors == 0 and session.failures == 4
+
+
+def test_gives_up_after_attempts(server):
+    server.throttled = {'a', 'b'}
+    pool = pool_on(server, ['a', 'b'], rest=60, attempts=2)
+    with pytest.raises(TooManyRequestsError):
+        pool.fetch(['term'])
+    assert server.hits == {'a': 1, 'b': 1}
+    assert pool.healthy == 0
+
+
+def test_bad_payload_does_not_rest_sessions(server):
+    pool = pool_on(server, ['a'], rest=60)
+    with pytest.raises(ResponseError) as error:
+        pool.fetch(['bad'])
+    assert error.value.response.status_code == 400
+    session = pool.sessions[0]
+    assert (session.errors, session.rest_until, server.hits['a']) == (0, 0., 1)
+
+
+def test_transport_errors_rest_sessions():
+    dead = StandInServer()
+    dead.close()
+    pool = SessionPool([{}, {}], pace=0, jitter=0, rest=60, attempts=2,
+                       factory=lambda **config: StandInClient(dead.url, timeout=.5))
+    with pytest.raises(ConnectionError):
+        pool.fetch(['term'])
+    assert [ss.failures for ss in pool.sessions] == [1, 1]
+
+
+def test_payloads_are_per_thread(server):
+    pool = pool_on(server, ['a', 'b', 'c'])
+
+    def pull(kw):
+        pool.build_payload([kw], timeframe='today 5-y')
+        time.sleep(.05) # let the other threads build theirs
+        return list(pool.interest_over_time().columns[:-1])
+
+    with ThreadPoolExecutor(max_workers=3) as threads:
+        assert list(threads.map(pull, ['x', 'y', 'z'])) == [['x'], ['y'], ['z']]
+
+
+def test_checks_arguments(server):
+    with pytest.raises(ValueError, match='attempt'):
+        pool_on(server, ['a'], attempts=0)
+    with pytest.raises(ValueError, match='tz'):
+        SessionPool([{'tz': 300}, {'tz': 0}],
+                    factory=lambda **config: StandInClient(server.url, **config))
+
+
+class SlowStub(StubTrendReq):
+    """A stub client that takes a while to answer, like Trends does."""
+    def interest_over_time(self):
+        time.sleep(.1)
+        return super().interest_over_time()
+
+
+VOLUMES = {'term %s' %ii: wave(20+5*ii, period=3+ii%5) for ii in range(17)}
+
+
+def stub_pool(size, volumes=VOLUMES):
+    return SessionPool([{}]*size, pace=0, jitter=0,
+                       factory=lambda **config: SlowStub(volumes, **config))
+
+
+def timed_index(pytrend, date_start, **kwargs):
+    t0 = time.monotonic()
+    result = Trendex(list(VOLUMES), 'US', date_start=date_start, date_end='2020-03-31',
+                     plot=False, slowdown=False, benchmark_select=False,
+                     pytrend=pytrend, **kwargs)
+    return result, time.monotonic() - t0
+
+
+@pytest.mark.parametrize('date_start, chunks', [('2020-01-01', 1), ('2019-06-01', 2)])
+def test_index_search_groups_run_in_parallel(date_start, chunks):
+    one, slow = timed_index(stub_pool(1), date_start)
+    pool = stub_pool(4)
+    four, fast = timed_index(pool, date_start)
+    assert len(four.timechunks) == chunks
+    pd.testing.assert_frame_equal(four.trends, one.trends)
+    # 4 search groups of the 17 terms per timechunk
+    payloads = [len(ss.client.payloads) for ss in pool.sessions]
+    assert sum(payloads) == 4*chunks and min(payloads) >= 1
+    assert fast < slow/2
+
+
+def test_hierarchical_leaves_run_in_parallel():
+    one, slow = timed_index(stub_pool(1), '2020-01-01', hierarchical=True)
+    pool = stub_pool(4)
+    four, fast = timed_index(pool, '2020-01-01', hierarchical=True)
+    pd.testing.assert_frame_equal(four.trends, one.trends)
+    assert min(len(ss.client.payloads) for ss in pool.sessions) >= 1
+    assert fast < slow/1.5